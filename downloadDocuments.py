@@ -1,24 +1,43 @@
 import os
-import json
+import orjson
+import ijson
+import re
+import time
+import tempfile
+import zipfile
+import threading
+import queue
+import multiprocessing
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
 import requests 
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from dotenv import load_dotenv 
 from azure.storage.blob import BlobServiceClient
 from datetime import datetime, timezone, timedelta
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, BinaryIO, Iterator
 from functools import lru_cache
+from cachetools import TTLCache
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
 
 # For text extraction
-import pdfplumber
+import pymupdf
+from pdfFallback import extract_pdf_pages_worker
 from docx import Document
+from lxml import etree
 from pptx import Presentation
-from io import BytesIO 
-import openpyxl
-import xlrd
+from io import BytesIO
+from python_calamine import CalamineWorkbook
 
 
-# Load .env
-load_dotenv()
-print("loaded env")
+# Load .env (skipped in PDF pool workers, which re-run this script on start)
+if multiprocessing.current_process().name == "MainProcess":
+    load_dotenv()
+    print("loaded env")
 
 TENANT_ID = os.getenv("TENANT_ID")
 CLIENT_ID = os.getenv("SHAREPOINT_CLIENT_ID")
@@ -34,37 +53,218 @@ SITES_LIST = [
     # "yourdomain.sharepoint.com,site-guid,web-guid",
 ]
 
-# Cache token for 55 minutes (tokens expire after 60 minutes)
-_token_cache = {"token": None, "expires_at": None}
+# PDF text comes from PyMuPDF; set PDF_BACKEND=pdfminer to retry pages where
+# PyMuPDF finds no text with pdfminer.six ("pdfplumber" is accepted as an alias)
+PDF_BACKEND = os.getenv("PDF_BACKEND", "pymupdf").lower()
+
+# The pdfminer fallback runs in child processes that are replaced every
+# PDF_POOL_TASKS_PER_CHILD files, so its leaked memory goes back to the OS
+PDF_POOL_WORKERS = 4
+PDF_POOL_TASKS_PER_CHILD = 50
+
+# Imported once in the forkserver so recycled workers, which re-run this script,
+# find them already loaded. This script itself isn't preloaded: the forkserver
+# would then load .env and print like the main process
+PDF_POOL_PRELOAD = [
+    "pdfFallback", "pymupdf", "docx", "lxml.etree", "pptx", "python_calamine",
+    "requests", "azure.storage.blob", "ijson", "orjson", "cachetools", "dotenv",
+]
+_pdf_pool: Optional[ProcessPoolExecutor] = None
+_pdf_pool_lock = threading.Lock()
+
+# Upper bound on concurrent Graph requests (folder listings + file downloads)
+MAX_CONCURRENT_REQUESTS = 32
+_io_pool = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_REQUESTS)
+
+# Sites and libraries synced at once. These threads only coordinate; the
+# actual Graph requests they generate still go through _io_pool
+MAX_CONCURRENT_SITES = 16
+MAX_CONCURRENT_LIBRARIES = 8
+
+# Files at least this large are streamed to a temp file instead of held in memory
+STREAM_TO_DISK_THRESHOLD = 8 * 1024 * 1024
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+# Largest page Graph returns for list endpoints (default is 200 for /children)
+GRAPH_PAGE_SIZE = 999
+
+# Key of a page's next-page URL. Nested collections label theirs
+# "<property>@odata.nextLink" and quotes inside strings are escaped, so this
+# byte sequence only ever matches the page's own link
+NEXT_LINK_KEY = b'"@odata.nextLink"'
+NEXT_LINK_VALUE = re.compile(rb'\s*:\s*("(?:[^"\\]|\\.)*")')
+
+# .docx files at least this large are parsed with iterparse instead of python-docx
+DOCX_XML_THRESHOLD = 8 * 1024 * 1024
+
+# WordprocessingML namespace, for parsing large .docx files without python-docx
+WORD_NS = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+
+# Run elements other than w:t / w:br and the text python-docx renders for them
+WORD_RUN_TEXT = {
+    f"{WORD_NS}tab": "\t",
+    f"{WORD_NS}ptab": "\t",
+    f"{WORD_NS}cr": "\n",
+    f"{WORD_NS}noBreakHyphen": "-",
+}
+
+# Graph accepts at most 20 sub-requests per $batch call
+GRAPH_BATCH_LIMIT = 20
+
+# Shared session: keeps connections alive across calls and retries throttled requests
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(
+    pool_connections=64,
+    pool_maxsize=64,
+    max_retries=Retry(total=5, backoff_factor=0.5, status_forcelist=[429, 503], raise_on_status=False),
+))
+
+# Cache token for 55 minutes (tokens expire after 60 minutes), per app registration
+_token_cache: Dict[tuple, Dict[str, Any]] = {}
+_token_lock = threading.Lock()
+
+# Tokens are also kept on disk so a new run can reuse one that is still valid
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "rag-pipeline")
+TOKEN_CACHE_FILE = os.path.join(CACHE_DIR, "token.json")
+
+# Group memberships by UPN, reused across every permission check in a sync
+_group_cache = TTLCache(maxsize=100_000, ttl=3600)
+_group_cache_lock = threading.Lock()
+
+def lock_file(f, shared: bool = False):
+    """Advisory lock on an open cache file, released when it is closed (no-op without fcntl)"""
+    if fcntl is not None:
+        fcntl.flock(f, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+
+def load_cached_token(key: tuple) -> Optional[Dict[str, Any]]:
+    """Read a token saved by a previous run, if any"""
+    try:
+        with open(TOKEN_CACHE_FILE, "rb") as f:
+            lock_file(f, shared=True)
+            entry = orjson.loads(f.read()).get(":".join(map(str, key)))
+        if not entry:
+            return None
+        return {"token": entry["token"], "expires_at": datetime.fromisoformat(entry["expires_at"])}
+    except (OSError, ValueError, KeyError, AttributeError):
+        return None
+
+def save_cached_token(key: tuple, cached: Dict[str, Any]):
+    """Persist a token (0600) so the next run can reuse it until it expires"""
+    try:
+        os.makedirs(CACHE_DIR, mode=0o700, exist_ok=True)
+        fd = os.open(TOKEN_CACHE_FILE, os.O_RDWR | os.O_CREAT, 0o600)
+        # O_CREAT's mode only applies to new files; tighten an existing one too
+        if hasattr(os, "fchmod"):
+            os.fchmod(fd, 0o600)
+        with os.fdopen(fd, "r+b") as f:
+            lock_file(f)
+            try:
+                tokens = orjson.loads(f.read() or b"{}")
+            except orjson.JSONDecodeError:
+                tokens = {}
+            tokens[":".join(map(str, key))] = {
+                "token": cached["token"],
+                "expires_at": cached["expires_at"].isoformat()
+            }
+            f.seek(0)
+            f.truncate()
+            f.write(orjson.dumps(tokens))
+    except OSError as e:
+        print(f"⚠️ Could not save token cache: {e}")
 
 def get_graph_token():
-    """Generate Graph App-only token with caching"""
-    now = datetime.now(timezone.utc)
-    
-    # Return cached token if still valid
-    if _token_cache["token"] and _token_cache["expires_at"] and now < _token_cache["expires_at"]:
-        return _token_cache["token"]
-    
-    token_url = f"https://login.microsoftonline.com/{TENANT_ID}/oauth2/v2.0/token"
-    data = {
-        "grant_type": "client_credentials",
-        "client_id": CLIENT_ID,
-        "client_secret": CLIENT_SECRET,
-        "scope": "https://graph.microsoft.com/.default"
-    }
-    r = requests.post(token_url, data=data)
-    r.raise_for_status()
-    token_data = r.json()
-    
-    # Cache token (expires in 3600 seconds, cache for 3300 to be safe)
-    _token_cache["token"] = token_data["access_token"]
-    _token_cache["expires_at"] = now.replace(microsecond=0) + timedelta(seconds=3300)
-    
-    return _token_cache["token"]
+    """Generate Graph App-only token with caching (also sets it on SESSION)"""
+    key = (TENANT_ID, CLIENT_ID)
+
+    with _token_lock:
+        now = datetime.now(timezone.utc)
+        
+        # Return cached token if still valid (falling back to the last run's token on disk)
+        cached = _token_cache.get(key) or load_cached_token(key)
+        if cached and now < cached["expires_at"]:
+            if _token_cache.get(key) is not cached:
+                _token_cache[key] = cached
+                SESSION.headers["Authorization"] = f"Bearer {cached['token']}"
+            return cached["token"]
+        
+        token_url = f"https://login.microsoftonline.com/{TENANT_ID}/oauth2/v2.0/token"
+        data = {
+            "grant_type": "client_credentials",
+            "client_id": CLIENT_ID,
+            "client_secret": CLIENT_SECRET,
+            "scope": "https://graph.microsoft.com/.default"
+        }
+        # Don't send the stale Graph token to the login endpoint
+        r = SESSION.post(token_url, data=data, headers={"Authorization": None})
+        r.raise_for_status()
+        token_data = r.json()
+        
+        # Cache token (expires in 3600 seconds, cache for 3300 to be safe)
+        _token_cache[key] = {
+            "token": token_data["access_token"],
+            "expires_at": now.replace(microsecond=0) + timedelta(seconds=3300)
+        }
+        SESSION.headers["Authorization"] = f"Bearer {token_data['access_token']}"
+        save_cached_token(key, _token_cache[key])
+        
+        return token_data["access_token"]
+
+def graph_get(url: str, **kwargs) -> requests.Response:
+    """GET on the shared session, refreshing the Graph token first if it expired"""
+    get_graph_token()
+    return SESSION.get(url, **kwargs)
+
+class NextLinkReader:
+    """
+    File-like wrapper ijson reads a streamed Graph page through. @odata.nextLink
+    is picked out of the raw bytes on the way past, so the items themselves
+    can go through ijson.items (C backend) in a single pass.
+    """
+    def __init__(self, raw: BinaryIO):
+        self.raw = raw
+        self.next_link: Optional[str] = None
+        self._pending = b""
+
+    def read(self, size: int = -1) -> bytes:
+        chunk = self.raw.read(size)
+        if self.next_link is None and chunk:
+            self._scan(self._pending + chunk)
+        return chunk
+
+    def _scan(self, data: bytes):
+        start = data.find(NEXT_LINK_KEY)
+        if start == -1:
+            # Keep enough bytes to rejoin a key split across two reads
+            self._pending = data[-(len(NEXT_LINK_KEY) - 1):]
+            return
+
+        match = NEXT_LINK_VALUE.match(data, start + len(NEXT_LINK_KEY))
+        if match:
+            self.next_link = orjson.loads(match.group(1))
+            self._pending = b""
+        else:
+            # Value hasn't fully arrived yet
+            self._pending = data[start:]
+
+def graph_list(url: str, page_size: Optional[int] = GRAPH_PAGE_SIZE) -> Iterator[Dict[str, Any]]:
+    """Yield every item of a Graph collection, following @odata.nextLink"""
+    if page_size:
+        url += ("&" if "?" in url else "?") + f"$top={page_size}"
+
+    while url:
+        # Stream-parse the page instead of materializing the whole response
+        with graph_get(url, stream=True) as r:
+            r.raise_for_status()
+            r.raw.decode_content = True
+
+            page = NextLinkReader(r.raw)
+            yield from ijson.items(page, "value.item", use_float=True)
+
+            # nextLink already carries $top and the skip token
+            url = page.next_link
 
 def discover_all_sites() -> List[str]:
     """Auto-discover all SharePoint sites in the tenant"""
-    headers = {"Authorization": f"Bearer {get_graph_token()}"}
     sites = []
     
     print("🔍 Discovering SharePoint sites...")
@@ -72,33 +272,25 @@ def discover_all_sites() -> List[str]:
     # Get all sites
     url = "https://graph.microsoft.com/v1.0/sites?search=*"
     
-    while url:
-        r = requests.get(url, headers=headers)
-        r.raise_for_status()
-        data = r.json()
+    for site in graph_list(url):
+        # Extract site path in the format needed
+        site_id = site.get("id", "")
+        web_url = site.get("webUrl", "")
+        display_name = site.get("displayName", "")
         
-        for site in data.get("value", []):
-            # Extract site path in the format needed
-            site_id = site.get("id", "")
-            web_url = site.get("webUrl", "")
-            display_name = site.get("displayName", "")
-            
-            # Skip root site and personal sites
-            if "/sites/" in web_url or "/teams/" in web_url:
-                sites.append(site_id)
-                print(f"  ✓ Found: {display_name} ({site_id})")
-        
-        # Handle pagination
-        url = data.get("@odata.nextLink")
+        # Skip root site and personal sites
+        if "/sites/" in web_url or "/teams/" in web_url:
+            sites.append(site_id)
+            print(f"  ✓ Found: {display_name} ({site_id})")
     
     print(f"📊 Total sites discovered: {len(sites)}\n")
     return sites
 
+@lru_cache(maxsize=1024)
 def get_site_info(site_id: str) -> Dict[str, Any]:
     """Fetch site information for a given site ID"""
-    headers = {"Authorization": f"Bearer {get_graph_token()}"}
     url = f"https://graph.microsoft.com/v1.0/sites/{site_id}"
-    r = requests.get(url, headers=headers)
+    r = graph_get(url)
     r.raise_for_status()
     site_data = r.json()
     
@@ -108,188 +300,376 @@ def get_site_info(site_id: str) -> Dict[str, Any]:
         "webUrl": site_data.get("webUrl", "Unknown")
     }
 
-def get_all_document_libraries(site_id: str) -> List[Dict[str, Any]]:
-    """Get all document libraries (drives) for a site"""
-    headers = {"Authorization": f"Bearer {get_graph_token()}"}
+@lru_cache(maxsize=1024)
+def fetch_document_libraries(site_id: str) -> List[Dict[str, Any]]:
+    """Fetch all document libraries (drives) for a site; raises on error so failures aren't cached"""
     url = f"https://graph.microsoft.com/v1.0/sites/{site_id}/drives"
     
-    libraries = []
-    
+    return [
+        {
+            "id": drive.get("id"),
+            "name": drive.get("name"),
+            "driveType": drive.get("driveType"),
+            "webUrl": drive.get("webUrl")
+        }
+        for drive in graph_list(url)
+    ]
+
+def get_all_document_libraries(site_id: str) -> List[Dict[str, Any]]:
+    """Get all document libraries (drives) for a site"""
     try:
-        r = requests.get(url, headers=headers)
-        r.raise_for_status()
-        drives = r.json().get("value", [])
-        
-        for drive in drives:
-            libraries.append({
-                "id": drive.get("id"),
-                "name": drive.get("name"),
-                "driveType": drive.get("driveType"),
-                "webUrl": drive.get("webUrl")
-            })
-            
+        return fetch_document_libraries(site_id)
     except Exception as e:
         print(f"⚠️ Error fetching libraries for site {site_id}: {e}")
-    
-    return libraries
+        return []
 
-def get_file_permissions(site_id: str, drive_id: str, item_id: str) -> Dict[str, Any]:
-    """Get permissions for a specific file/folder"""
-    headers = {"Authorization": f"Bearer {get_graph_token()}"}
-    url = f"https://graph.microsoft.com/v1.0/sites/{site_id}/drives/{drive_id}/items/{item_id}/permissions"
-    
+def retry_after_seconds(headers: Dict[str, str], default: int) -> int:
+    """Seconds to wait per a Retry-After header (falls back to `default` if absent or not a number)"""
     try:
-        r = requests.get(url, headers=headers)
-        r.raise_for_status()
-        permissions = r.json().get("value", [])
-        
-        allowed_users = []
-        allowed_groups = []
-        is_public = False
+        return int(headers.get("Retry-After", default))
+    except (TypeError, ValueError):
+        return default
+
+def post_batch(url: str, payload: Dict[str, Any], max_retries: int) -> requests.Response:
+    """
+    POST one $batch payload. The session's Retry adapter doesn't retry POSTs,
+    so a throttled (429) or unavailable (503) batch is retried here.
+    """
+    for attempt in range(max_retries + 1):
+        get_graph_token()
+        r = SESSION.post(url, json=payload)
+        if r.status_code not in (429, 503) or attempt == max_retries:
+            break
+        time.sleep(retry_after_seconds(r.headers, 2 ** attempt))
+
+    r.raise_for_status()
+    return r
+
+def graph_batch(requests_list: List[str], max_retries: int = 5) -> List[Dict[str, Any]]:
+    """
+    Run GET requests through Graph's $batch endpoint, 20 sub-requests per POST.
+    `requests_list` holds URLs relative to /v1.0; sub-responses come back in the
+    same order. Throttled (429) sub-requests, and whole batches rejected with
+    429/503, are retried after their Retry-After.
+    """
+    url = "https://graph.microsoft.com/v1.0/$batch"
+    responses: List[Optional[Dict[str, Any]]] = [None] * len(requests_list)
+    pending = list(range(len(requests_list)))
+    attempt = 0
+
+    while pending:
+        throttled = []
+        retry_after = 1
+
+        for start in range(0, len(pending), GRAPH_BATCH_LIMIT):
+            chunk = pending[start:start + GRAPH_BATCH_LIMIT]
+            payload = {"requests": [
+                {"id": str(i), "method": "GET", "url": requests_list[i]} for i in chunk
+            ]}
+            r = post_batch(url, payload, max_retries)
+
+            # Demux sub-responses by id (Graph does not preserve order)
+            for resp in r.json().get("responses", []):
+                i = int(resp["id"])
+                if resp.get("status") == 429 and attempt < max_retries:
+                    throttled.append(i)
+                    retry_after = max(retry_after, retry_after_seconds(resp.get("headers", {}), 1))
+                else:
+                    responses[i] = resp
+
+        pending = throttled
+        attempt += 1
+        if pending:
+            time.sleep(retry_after)
+
+    return responses
+
+def parse_permissions(permissions: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Reduce a Graph permissions listing to allowed users/groups"""
+    allowed_users = set()
+    allowed_groups = set()
+    is_public = False
+    
+    for perm in permissions:
+        # Check if it's a link (shared with anyone)
+        if "link" in perm and perm.get("link", {}).get("scope") in ["anonymous", "organization"]:
+            is_public = True
+            continue
         
-        for perm in permissions:
-            # Check if it's a link (shared with anyone)
-            if "link" in perm and perm.get("link", {}).get("scope") in ["anonymous", "organization"]:
-                is_public = True
-                continue
+        # Get user principals (UPNs)
+        if "grantedToV2" in perm:
+            granted = perm["grantedToV2"]
             
-            # Get user principals (UPNs)
-            if "grantedToV2" in perm:
-                granted = perm["grantedToV2"]
-                
-                # Individual user
-                if "user" in granted:
-                    user_email = granted["user"].get("email")
-                    if user_email:
-                        allowed_users.append(user_email.lower())
-                
-                # Group
-                if "group" in granted:
-                    group_id = granted["group"].get("id")
-                    group_email = granted["group"].get("email")
-                    if group_id:
-                        allowed_groups.append(group_id)
-                    if group_email:
-                        allowed_groups.append(group_email.lower())
+            # Individual user
+            if "user" in granted:
+                user_email = granted["user"].get("email")
+                if user_email:
+                    allowed_users.add(user_email.lower())
             
-            # Legacy grantedTo format
-            elif "grantedTo" in perm:
-                granted = perm["grantedTo"]
-                if "user" in granted:
-                    user_email = granted["user"].get("email")
-                    if user_email:
-                        allowed_users.append(user_email.lower())
-        
-        # Handle inherited permissions (most common case)
-        has_inherited = len(permissions) == 0 or any(
-            perm.get("inheritedFrom") for perm in permissions
-        )
+            # Group
+            if "group" in granted:
+                group_id = granted["group"].get("id")
+                group_email = granted["group"].get("email")
+                if group_id:
+                    allowed_groups.add(group_id)
+                if group_email:
+                    allowed_groups.add(group_email.lower())
         
-        return {
-            "allowedUsers": list(set(allowed_users)),  # Remove duplicates
-            "allowedGroups": list(set(allowed_groups)),
-            "hasInheritedPermissions": has_inherited,
-            "isPublicWithinOrg": is_public
-        }
-        
-    except Exception as e:
-        print(f"⚠️ Error fetching permissions for item {item_id}: {e}")
-        return {
-            "allowedUsers": [],
-            "allowedGroups": [],
-            "hasInheritedPermissions": True,
-            "isPublicWithinOrg": False,
-            "permissionError": str(e)
-        }
+        # Legacy grantedTo format
+        elif "grantedTo" in perm:
+            granted = perm["grantedTo"]
+            if "user" in granted:
+                user_email = granted["user"].get("email")
+                if user_email:
+                    allowed_users.add(user_email.lower())
+    
+    # Handle inherited permissions (most common case)
+    has_inherited = len(permissions) == 0 or any(
+        perm.get("inheritedFrom") for perm in permissions
+    )
+    
+    return {
+        "allowedUsers": list(allowed_users),
+        "allowedGroups": list(allowed_groups),
+        "hasInheritedPermissions": has_inherited,
+        "isPublicWithinOrg": is_public
+    }
 
-def extract_text(name: str, stream: BytesIO) -> Optional[str]:
-    """Extract text from PDF, DOCX, PPTX, TXT, CSV, JSON, HTML, and Excel."""
-    suffix = name.lower().split(".")[-1]
-    stream.seek(0)
+def permission_error(error: str) -> Dict[str, Any]:
+    """Fallback permissions when they could not be fetched"""
+    return {
+        "allowedUsers": [],
+        "allowedGroups": [],
+        "hasInheritedPermissions": True,
+        "isPublicWithinOrg": False,
+        "permissionError": error
+    }
 
-    try:
-        # ---------------------- PDF ----------------------
-        if suffix == "pdf":
-            text = ""
-            with pdfplumber.open(stream) as pdf:
-                for page in pdf.pages:
-                    t = page.extract_text()
-                    if t:
-                        text += t + "\n"
-            return text.strip()
-
-        # ---------------------- DOCX ----------------------
-        if suffix == "docx":
-            doc = Document(stream)
-            return "\n".join([p.text for p in doc.paragraphs]).strip()
-
-        # ---------------------- PPTX ----------------------
-        if suffix == "pptx":
-            prs = Presentation(stream)
-            slide_text = []
-            for slide in prs.slides:
-                for shape in slide.shapes:
-                    if shape.has_text_frame:
-                        for p in shape.text_frame.paragraphs:
-                            slide_text.append(p.text)
-            return "\n".join(slide_text).strip()
-
-        # ---------------------- CSV ----------------------
-        if suffix == "csv":
-            text = stream.read().decode("utf-8", errors="ignore")
-            return text.strip()
-
-        # ---------------------- Excel (.xlsx, .xlsm) ----------------------
-        if suffix in ["xlsx", "xlsm"]:
-            wb = openpyxl.load_workbook(stream, read_only=True, data_only=True)
-            output = []
-
-            for sheet in wb.sheetnames:
-                ws = wb[sheet]
-                output.append(f"[{sheet}]")
-                for row in ws.iter_rows(values_only=True):
-                    row_text = ",".join("" if v is None else str(v) for v in row)
-                    output.append(row_text)
-                output.append("")
-
-            return "\n".join(output).strip()
-
-        # ---------------------- Excel (.xls – legacy) ----------------------
-        if suffix == "xls":
+def get_permissions_batch(site_id: str, drive_id: str, item_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+    """Get permissions for several files/folders at once via $batch, keyed by item ID"""
+    urls = [f"/sites/{site_id}/drives/{drive_id}/items/{item_id}/permissions" for item_id in item_ids]
+    permissions = {}
+
+    for item_id, resp in zip(item_ids, graph_batch(urls)):
+        resp = resp or {}
+        if resp.get("status") == 200:
+            body = resp.get("body", {})
+            value = body.get("value", [])
             try:
-                stream.seek(0)
-                book = xlrd.open_workbook(file_contents=stream.read())
-                output = []
-
-                for i in range(book.nsheets):
-                    sheet = book.sheet_by_index(i)
-                    output.append(f"[{sheet.name}]")
-                    for r in range(sheet.nrows):
-                        row = sheet.row_values(r)
-                        row_text = ",".join("" if v is None else str(v) for v in row)
-                        output.append(row_text)
-                    output.append("")
-
-                return "\n".join(output).strip()
+                # Items with many grants page their permissions like any other list
+                if body.get("@odata.nextLink"):
+                    value = value + list(graph_list(body["@odata.nextLink"], page_size=None))
+                permissions[item_id] = parse_permissions(value)
             except Exception as e:
-                print(f"⚠️ XLS extraction failed: {e}")
+                print(f"⚠️ Error fetching permissions for item {item_id}: {e}")
+                permissions[item_id] = permission_error(str(e))
+        else:
+            error = resp.get("body", {}).get("error", {}).get("message", f"HTTP {resp.get('status')}")
+            print(f"⚠️ Error fetching permissions for item {item_id}: {error}")
+            permissions[item_id] = permission_error(error)
+
+    return permissions
 
-        # ---------------------- Simple text formats ----------------------
-        if suffix in ["txt", "md", "json", "xml", "html"]:
-            return stream.read().decode("utf-8", errors="ignore").strip()
+def docx_paragraph_text(p) -> str:
+    """Text of a w:p element, matching python-docx's Paragraph.text (runs and hyperlink runs)"""
+    parts = []
 
+    for child in p:
+        if child.tag == f"{WORD_NS}r":
+            runs = (child,)
+        elif child.tag == f"{WORD_NS}hyperlink":
+            runs = child.iterchildren(f"{WORD_NS}r")
+        else:
+            continue
+
+        for run in runs:
+            for el in run:
+                if el.tag == f"{WORD_NS}t":
+                    parts.append(el.text or "")
+                elif el.tag == f"{WORD_NS}br":
+                    # Only line breaks produce text; page/column breaks don't
+                    if el.get(f"{WORD_NS}type", "textWrapping") == "textWrapping":
+                        parts.append("\n")
+                elif el.tag in WORD_RUN_TEXT:
+                    parts.append(WORD_RUN_TEXT[el.tag])
+
+    return "".join(parts)
+
+def extract_docx_xml(stream: BinaryIO) -> str:
+    """
+    Pull body paragraph text straight out of word/document.xml with iterparse.
+    Yields the same paragraphs as python-docx's doc.paragraphs (top-level w:p only).
+    """
+    paragraphs = []
+
+    with zipfile.ZipFile(stream) as docx, docx.open("word/document.xml") as xml:
+        for _, p in etree.iterparse(xml, events=("end",), tag=f"{WORD_NS}p"):
+            body = p.getparent()
+            is_body_paragraph = body.tag == f"{WORD_NS}body"
+            if is_body_paragraph:
+                paragraphs.append(docx_paragraph_text(p))
+
+            # Free parsed paragraphs (and tables before them) as we go so memory stays flat
+            p.clear()
+            if is_body_paragraph:
+                while p.getprevious() is not None:
+                    del body[0]
+
+    return "\n".join(paragraphs)
+
+# ---------------------- PDF ----------------------
+def get_pdf_pool() -> ProcessPoolExecutor:
+    """Start the PDF fallback process pool on first use"""
+    global _pdf_pool
+    with _pdf_pool_lock:
+        if _pdf_pool is None:
+            # max_tasks_per_child rules out "fork", and every recycled child re-runs
+            # this script. Forkserver children inherit PDF_POOL_PRELOAD instead of
+            # importing it again. Windows only has spawn
+            if "forkserver" in multiprocessing.get_all_start_methods():
+                mp_context = multiprocessing.get_context("forkserver")
+                mp_context.set_forkserver_preload(PDF_POOL_PRELOAD)
+            else:
+                mp_context = multiprocessing.get_context("spawn")
+            _pdf_pool = ProcessPoolExecutor(max_workers=PDF_POOL_WORKERS,
+                                            mp_context=mp_context,
+                                            max_tasks_per_child=PDF_POOL_TASKS_PER_CHILD)
+        return _pdf_pool
+
+def extract_pdf(stream: BinaryIO) -> str:
+    """Extract PDF text with PyMuPDF (optionally retrying empty pages with pdfminer)"""
+    global _pdf_pool
+    # Files streamed to disk are opened by path rather than read into memory
+    path = getattr(stream, "name", None)
+    if path:
+        doc = pymupdf.open(path)
+    else:
+        doc = pymupdf.open(stream=stream.read(), filetype="pdf")
+    with doc:
+        pages = [page.get_text("text") for page in doc]
+
+    # Optional pdfminer fallback for pages PyMuPDF found no text on. It runs in a
+    # recycled child process because pdfminer leaks memory per page parsed
+    empty_pages = [i for i, t in enumerate(pages) if not t.strip()]
+    if PDF_BACKEND in ("pdfminer", "pdfplumber") and empty_pages:
+        if not path:
+            stream.seek(0)
+        source = path or stream.read()
+        pool = get_pdf_pool()
+        try:
+            texts = pool.submit(extract_pdf_pages_worker, source, empty_pages).result()
+        except BrokenProcessPool as e:
+            # A worker died (e.g. OOM-killed) and took the pool with it; start a new one next time
+            with _pdf_pool_lock:
+                if _pdf_pool is pool:
+                    _pdf_pool = None
+            pool.shutdown(wait=False)
+            print(f"⚠️ PDF fallback pool failed, keeping PyMuPDF text: {e}")
+            texts = []
+        except Exception as e:
+            print(f"⚠️ PDF fallback failed, keeping PyMuPDF text: {e}")
+            texts = []
+        for i, t in zip(empty_pages, texts):
+            pages[i] = t
+
+    return "\n".join(t.strip() for t in pages if t.strip())
+
+# ---------------------- DOCX ----------------------
+def extract_docx(stream: BinaryIO) -> str:
+    """Extract paragraph text from a Word document"""
+    # Large documents skip python-docx's object model and stream the raw XML
+    stream.seek(0, os.SEEK_END)
+    if stream.tell() >= DOCX_XML_THRESHOLD:
+        stream.seek(0)
+        return extract_docx_xml(stream).strip()
+
+    stream.seek(0)
+    doc = Document(stream)
+    return "\n".join(p.text for p in doc.paragraphs).strip()
+
+# ---------------------- PPTX ----------------------
+def extract_pptx(stream: BinaryIO) -> str:
+    """Extract text frame paragraphs from every slide"""
+    prs = Presentation(stream)
+    return "\n".join(
+        p.text
+        for slide in prs.slides
+        for shape in slide.shapes
+        if shape.has_text_frame
+        for p in shape.text_frame.paragraphs
+    ).strip()
+
+# ---------------------- Excel (.xlsx, .xlsm, .xls) ----------------------
+def format_cell(value: Any) -> str:
+    """Render a spreadsheet cell; calamine returns whole numbers as floats, so show 2024.0 as 2024"""
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+def extract_excel(stream: BinaryIO) -> str:
+    """Extract every sheet as comma-joined rows under a [sheet] header"""
+    wb = CalamineWorkbook.from_filelike(stream)
+    output = []
+
+    for sheet in wb.sheet_names:
+        output.append(f"[{sheet}]")
+        for row in wb.get_sheet_by_name(sheet).to_python():
+            row_text = ",".join(format_cell(v) for v in row)
+            output.append(row_text)
+        output.append("")
+
+    return "\n".join(output).strip()
+
+# ---------------------- Simple text formats (incl. CSV) ----------------------
+def extract_plain_text(stream: BinaryIO) -> str:
+    """Decode a text file as UTF-8, ignoring invalid bytes"""
+    return stream.read().decode("utf-8", errors="ignore").strip()
+
+# Lower-case file extension → extractor
+_EXTRACTORS = {
+    "pdf": extract_pdf,
+    "docx": extract_docx,
+    "pptx": extract_pptx,
+    "xlsx": extract_excel,
+    "xlsm": extract_excel,
+    "xls": extract_excel,
+    "csv": extract_plain_text,
+    "txt": extract_plain_text,
+    "md": extract_plain_text,
+    "json": extract_plain_text,
+    "xml": extract_plain_text,
+    "html": extract_plain_text,
+}
+
+def extract_text(name: str, stream: BinaryIO) -> Optional[str]:
+    """Extract text from PDF, DOCX, PPTX, TXT, CSV, JSON, HTML, and Excel."""
+    extractor = _EXTRACTORS.get(name[name.rfind(".") + 1:].lower())
+    if extractor is None:
+        return None
+
+    stream.seek(0)
+
+    try:
+        return extractor(stream)
     except Exception as e:
         print(f"⚠️ Text extraction failed for {name}: {e}")
 
     return None
 
 def build_metadata(item: Dict[str, Any], current_path: str, extracted_text: Optional[str], 
-                   site_info: Dict[str, Any], library_name: str) -> Dict[str, Any]:
+                   site_info: Dict[str, Any], library_name: str,
+                   permissions: Optional[Dict[str, Any]] = None,
+                   synced_at: Optional[str] = None) -> Dict[str, Any]:
     """Build comprehensive metadata object"""
+    name = item["name"]
+    dot = name.rfind(".")
+
     metadata = {
         # File identification
-        "fileName": item["name"],
-        "fileExtension": item["name"].split(".")[-1].lower() if "." in item["name"] else "",
+        "fileName": name,
+        "fileExtension": name[dot + 1:].lower() if dot >= 0 else "",
         "fileId": item["id"],
         "sharePointPath": current_path,
         "mimeType": item.get("file", {}).get("mimeType", "unknown"),
@@ -309,6 +689,7 @@ def build_metadata(item: Dict[str, Any], current_path: str, extracted_text: Opti
         "lastModifiedBy": item.get("lastModifiedBy", {}).get("user", {}).get("displayName", "Unknown"),
         "lastModifiedByEmail": item.get("lastModifiedBy", {}).get("user", {}).get("email", "Unknown"),
         "lastModifiedAt": item["lastModifiedDateTime"],
+        "eTag": item.get("eTag"),
         
         # File properties
         "size": item.get("size", 0),
@@ -316,7 +697,7 @@ def build_metadata(item: Dict[str, Any], current_path: str, extracted_text: Opti
         "webUrl": item.get("webUrl"),
         
         # Sync metadata
-        "syncedAt": datetime.now(timezone.utc).isoformat(),
+        "syncedAt": synced_at or datetime.now(timezone.utc).isoformat(),
         "hasExtractedText": extracted_text is not None and len(extracted_text) > 0,
     }
     
@@ -328,6 +709,10 @@ def build_metadata(item: Dict[str, Any], current_path: str, extracted_text: Opti
         if "sha1Hash" in hashes:
             metadata["sha1Hash"] = hashes["sha1Hash"]
     
+    # Add access control fields if available
+    if permissions:
+        metadata.update(permissions)
+    
     # Add extracted text if available
     if extracted_text:
         metadata["contentText"] = extracted_text
@@ -343,97 +728,224 @@ def format_bytes(size: int) -> str:
         size /= 1024.0
     return f"{size:.2f} PB"
 
+# Characters that are invalid in blob paths, all mapped to '_'
+_SANITIZE_TABLE = str.maketrans({c: "_" for c in '<>:"/\\|?*'})
+
 def sanitize_folder_name(name: str) -> str:
     """Sanitize site/library names for blob storage paths"""
-    # Remove or replace invalid characters for blob paths
-    invalid_chars = ['<', '>', ':', '"', '/', '\\', '|', '?', '*']
-    for char in invalid_chars:
-        name = name.replace(char, '_')
-    return name.strip()
+    # Replace invalid characters for blob paths in a single pass
+    return name.translate(_SANITIZE_TABLE).strip()
 
-def sync_library_children(site_id: str, drive_id: str, item_id: Optional[str] = None, 
-                          relative_path: str = "", site_info: Dict[str, Any] = None,
-                          library_name: str = "Documents", blob_base_path: str = "",
-                          library_permissions: Optional[Dict[str, Any]] = None):
-    """Recursively sync all items in a document library"""
-    
-    # Build URL
+def list_children(site_id: str, drive_id: str, item_id: Optional[str] = None) -> List[Dict[str, Any]]:
+    """List the direct children of a folder (or of the library root)"""
     if item_id:
         url = f"https://graph.microsoft.com/v1.0/sites/{site_id}/drives/{drive_id}/items/{item_id}/children"
     else:
         url = f"https://graph.microsoft.com/v1.0/sites/{site_id}/drives/{drive_id}/root/children"
 
-    headers = {"Authorization": f"Bearer {get_graph_token()}"}
-    
-    try:
-        r = requests.get(url, headers=headers)
-        r.raise_for_status()
-        items = r.json().get("value", [])
-    except Exception as e:
-        print(f"⚠️ Error accessing library: {e}")
-        return
+    # Collected in full: the coordinator walks a folder's items in one go
+    return list(graph_list(url))
+
+def sync_library_children(site_id: str, drive_id: str, item_id: Optional[str] = None, 
+                          relative_path: str = "", site_info: Dict[str, Any] = None,
+                          library_name: str = "Documents", blob_base_path: str = "",
+                          library_permissions: Optional[Dict[str, Any]] = None,
+                          synced_at: Optional[str] = None):
+    """Sync all items in a document library.
+
+    Folder listings and file downloads are queued on the shared I/O pool so they
+    run concurrently; this function only walks the results and returns once
+    every file below the starting folder has been processed.
+    """
+    # Confirms that the directory to download is there
+    home = os.path.expanduser("~")
+    directoryName = os.path.join(home, "Documents", "RAG_DATA_ROOT")
+
+    if not os.path.exists(directoryName):
+        os.makedirs(directoryName, exist_ok=True)
+        print(f"Directory made: {directoryName}")
+
+    # Listings and permission batches report here as they finish, tagged with their
+    # kind and the folder path / files they belong to; `pending` counts the rest
+    completed = queue.Queue()
+    pending = 0
+    downloads = {}
+
+    def submit(kind: str, context, fn, *args):
+        nonlocal pending
+        pending += 1
+        future = _io_pool.submit(fn, *args)
+        future.add_done_callback(lambda f: completed.put((kind, context, f)))
+
+    submit("listing", relative_path, list_children, site_id, drive_id, item_id)
+
+    while pending:
+        kind, context, future = completed.get()
+        pending -= 1
+
+        # Folder listed → recurse into subfolders, batch permissions for files
+        if kind == "listing":
+            folder_path = context
+            try:
+                items = future.result()
+            except Exception as e:
+                print(f"⚠️ Error accessing library: {e}")
+                continue
 
-    for item in items:
-        current_path = f"{relative_path}/{item['name']}".lstrip("/")
+            files = []
+            for item in items:
+                current_path = f"{folder_path}/{item['name']}".lstrip("/")
 
-        # Folder → recurse
-        if "folder" in item:
-            print(f"📁 Folder: {blob_base_path}/{current_path}")
-            sync_library_children(site_id, drive_id, item["id"], current_path, 
-                                 site_info, library_name, blob_base_path, library_permissions)
+                # Folder → list its children concurrently
+                if "folder" in item:
+                    print(f"📁 Folder: {blob_base_path}/{current_path}")
+                    submit("listing", current_path, list_children, site_id, drive_id, item["id"])
+                else:
+                    files.append((item, current_path))
 
-        # File → check timestamps, upload if changed
+            # One $batch call fetches permissions for up to 20 files
+            for start in range(0, len(files), GRAPH_BATCH_LIMIT):
+                batch = files[start:start + GRAPH_BATCH_LIMIT]
+                item_ids = [item["id"] for item, _ in batch]
+                submit("permissions", batch, get_permissions_batch, site_id, drive_id, item_ids)
+
+        # Permissions fetched → download the files in the background
         else:
-            # Confirms that the directory to download is there
-            home = os.path.expanduser("~")
-            directoryName = os.path.join(home, 'Documents\RAG_DATA_ROOT')
+            batch = context
+            try:
+                permissions = future.result()
+            except Exception as e:
+                print(f"⚠️ Error fetching permissions batch: {e}")
+                permissions = {item["id"]: permission_error(str(e)) for item, _ in batch}
+
+            for item, current_path in batch:
+                # Defining some required variables
+                file_blob_path = f"{blob_base_path}/{current_path}"
+                meta_blob_path = file_blob_path + ".meta.json"
+
+                # Uploads data
+                download = _io_pool.submit(uploadData, file_blob_path, meta_blob_path, site_id, drive_id, item,
+                                           current_path, site_info, library_name, directoryName,
+                                           permissions[item["id"]], synced_at)
+                downloads[download] = current_path
+
+    for future in as_completed(downloads):
+        try:
+            future.result()
+        except Exception as e:
+            print(f"⚠️ Error syncing file {downloads[future]}: {e}")
+
+def download_to_tempfile(url: str) -> str:
+    """Stream a download to a named temp file and return its path (caller deletes it)"""
+    with tempfile.NamedTemporaryFile(delete=False) as tmp:
+        try:
+            with graph_get(url, stream=True) as r:
+                r.raise_for_status()
+                for chunk in r.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                    tmp.write(chunk)
+        except Exception:
+            tmp.close()
+            os.remove(tmp.name)
+            raise
+    return tmp.name
 
-            if not os.path.exists(directoryName):
-                os.mkdir(directoryName)
-                print(f"Directory made: {directoryName}")
+def load_metadata(meta_path: str) -> Optional[Dict[str, Any]]:
+    """Read metadata written by a previous sync, if any"""
+    try:
+        with open(meta_path, "rb") as f:
+            existing = orjson.loads(f.read())
+    except (OSError, orjson.JSONDecodeError):
+        return None
 
-            # Defining some required variables
-            file_blob_path = f"{blob_base_path}/{current_path}"
-            meta_blob_path = file_blob_path + ".meta.json"
+    return existing if isinstance(existing, dict) else None
 
-            # Uploads data
-            uploadData(file_blob_path, meta_blob_path, site_id, drive_id, item, headers, current_path, site_info, library_name, directoryName)
+def write_metadata(out_path: str, metadata: Dict[str, Any]):
+    """Write a metadata file, creating its folders as needed"""
+    try:
+        os.makedirs(os.path.dirname(out_path), exist_ok=True)
+        with open(out_path, "wb") as jsonFile:
+            jsonFile.write(orjson.dumps(metadata, option=orjson.OPT_INDENT_2))
+            print(f"Dumped: {out_path}")
+    except Exception as e:
+        print(f"Error uploading data: {e}")
 
-def uploadData(file_blob_path, meta_blob_path, site_id, drive_id, item, headers, current_path, site_info, library_name, directoryName):
+def is_unchanged(item: Dict[str, Any], existing: Dict[str, Any]) -> bool:
+    """Check whether stored metadata was written for this exact version of the item's content"""
+    return (
+        item.get("eTag") is not None
+        and item.get("eTag") == existing.get("eTag")
+        and item.get("lastModifiedDateTime") == existing.get("lastModifiedAt")
+    )
+
+def acl_unchanged(existing: Dict[str, Any], permissions: Optional[Dict[str, Any]]) -> bool:
+    """
+    Check whether stored access-control fields match freshly fetched permissions.
+    Permission changes don't touch eTag/lastModifiedDateTime, so this is checked separately;
+    a stored permissionError fallback never counts as up to date.
+    """
+    if "permissionError" in existing:
+        return False
+    if permissions is None:
+        return True
+    if "permissionError" in permissions:
+        return False
+
+    return (
+        set(existing.get("allowedUsers", [])) == set(permissions["allowedUsers"])
+        and set(existing.get("allowedGroups", [])) == set(permissions["allowedGroups"])
+        and existing.get("hasInheritedPermissions") == permissions["hasInheritedPermissions"]
+        and existing.get("isPublicWithinOrg") == permissions["isPublicWithinOrg"]
+    )
+
+def uploadData(file_blob_path, meta_blob_path, site_id, drive_id, item, current_path, site_info, library_name, directoryName, permissions=None, synced_at=None):
     """Actually downloads data to the local folder for ingesting
     1. Checks if the file exists / has been changed
     2. If required, downloads the data
     """
 
-    # Download file bytes from SharePoint
-    file_resp = requests.get(
-        f"https://graph.microsoft.com/v1.0/sites/{site_id}/drives/{drive_id}/items/{item['id']}/content",
-        headers=headers
-    )
-    file_resp.raise_for_status()
-    file_bytes = file_resp.content
-    extracted_text = extract_text(item["name"], BytesIO(file_bytes))
+    # Metadata lives beside the mirrored SharePoint path inside the data root
+    out_path = os.path.join(directoryName, *meta_blob_path.split("/"))
+
+    # Skip the download if this version of the file was already synced
+    existing = load_metadata(out_path)
+    if existing and is_unchanged(item, existing):
+        if acl_unchanged(existing, permissions):
+            print(f"Unchanged: {current_path}")
+            return
+
+        # Only the permissions changed → refresh them without re-downloading
+        if permissions is not None:
+            existing.pop("permissionError", None)
+            existing.update(permissions)
+        existing["syncedAt"] = synced_at or datetime.now(timezone.utc).isoformat()
+        write_metadata(out_path, existing)
+        return
+
+    content_url = f"https://graph.microsoft.com/v1.0/sites/{site_id}/drives/{drive_id}/items/{item['id']}/content"
+
+    # Small files are parsed straight from memory
+    if item.get("size", 0) < STREAM_TO_DISK_THRESHOLD:
+        file_resp = graph_get(content_url)
+        file_resp.raise_for_status()
+        extracted_text = extract_text(item["name"], BytesIO(file_resp.content))
+
+    # Large files are streamed to a temp file so memory use stays at one chunk
+    else:
+        tmp_path = download_to_tempfile(content_url)
+        try:
+            with open(tmp_path, "rb") as f:
+                extracted_text = extract_text(item["name"], f)
+        finally:
+            os.remove(tmp_path)
 
     # Build comprehensive metadata
     metadata = build_metadata(item, current_path, extracted_text, 
-                            site_info, library_name)
-
-    # Getting metadata JSON
-    name=meta_blob_path
-    print('ogname', name)
-    name=name.split('/')[-1]
-    print('newname', name)
-    data=json.dumps(metadata, indent=2)
+                            site_info, library_name, permissions, synced_at)
 
     # actually uploading data
-    try:
-        with open(f"{directoryName}\{name}", 'w') as jsonFile:
-            json.dump(data, jsonFile)
-            print(f"Dumped: {name}, In Directory: {directoryName}")
-    except Exception as e:
-        print(f"Error uploading data: {e}")
+    write_metadata(out_path, metadata)
 
-def sync_site(site_id: str):
+def sync_site(site_id: str, synced_at: Optional[str] = None):
     """Sync all document libraries in a single site"""
     
     # Get site information
@@ -455,16 +967,18 @@ def sync_site(site_id: str):
     for lib in libraries:
         print(f"  • {lib['name']} ({lib['driveType']})")
     
-    # Sync each library
-    for library in libraries:
-        library_name = sanitize_folder_name(library["name"])
-        blob_base_path = f"{site_name}/{library_name}"
-        
-        print(f"\nSyncing library: {library['name']}")
-        print(f"   Blob path: {blob_base_path}/")
-                
-        try:
-            sync_library_children(
+    # Sync libraries in parallel; each traversal shares the bounded I/O pool
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_LIBRARIES) as ex:
+        futures = {}
+        for library in libraries:
+            library_name = sanitize_folder_name(library["name"])
+            blob_base_path = f"{site_name}/{library_name}"
+            
+            print(f"\nSyncing library: {library['name']}")
+            print(f"   Blob path: {blob_base_path}/")
+            
+            future = ex.submit(
+                sync_library_children,
                 site_id=site_id,
                 drive_id=library["id"],
                 item_id=None,
@@ -472,14 +986,22 @@ def sync_site(site_id: str):
                 site_info=site_info,
                 library_name=library["name"],
                 blob_base_path=blob_base_path,
+                synced_at=synced_at,
             )
-        except Exception as e:
-            print(f"❌ Error syncing library {library['name']}: {e}")
-            continue
+            futures[future] = library
+
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                print(f"❌ Error syncing library {futures[future]['name']}: {e}")
 
 def sync_all_sites():
     """Main sync function - syncs all sites"""
     
+    # One timestamp for the whole run, stamped on every file's metadata
+    synced_at = datetime.now(timezone.utc).isoformat()
+    
     # Determine which sites to sync
     if AUTO_DISCOVER_SITES:
         sites = discover_all_sites()
@@ -493,13 +1015,14 @@ def sync_all_sites():
     
     print(f"\nStarting sync for {len(sites)} site(s)...\n")
     
-    # Sync each site
-    for site_id in sites:
-        try:
-            sync_site(site_id)
-        except Exception as e:
-            print(f"Error syncing site {site_id}: {e}")
-            continue
+    # Sync sites in parallel
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_SITES) as ex:
+        futures = {ex.submit(sync_site, site_id, synced_at): site_id for site_id in sites}
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                print(f"Error syncing site {futures[future]}: {e}")
     
     print(f"\n{'='*80}")
     print("All sites sync completed")
@@ -509,21 +1032,28 @@ def get_user_groups_from_graph(user_upn: str) -> List[str]:
     """
     Get all groups a user belongs to (for expanding group permissions).
     This uses app-only token, so it can query any user's groups.
+    Successful lookups are cached for an hour.
     """
-    headers = {"Authorization": f"Bearer {get_graph_token()}"}
-    url = f"https://graph.microsoft.com/v1.0/users/{user_upn}/transitiveMemberOf/microsoft.graph.group"
+    # UPNs are case-insensitive, so normalize before using them as cache keys
+    cache_key = user_upn.lower()
+    with _group_cache_lock:
+        if cache_key in _group_cache:
+            return _group_cache[cache_key]
+
+    # Only id and mail are used, so don't pull down full group objects
+    url = f"https://graph.microsoft.com/v1.0/users/{user_upn}/transitiveMemberOf/microsoft.graph.group?$select=id,mail"
     
     groups = []
     try:
-        r = requests.get(url, headers=headers)
-        r.raise_for_status()
-        
-        for group in r.json().get("value", []):
+        for group in graph_list(url):
             groups.append(group.get("id"))
             if group.get("mail"):
                 groups.append(group.get("mail").lower())
         
         print(f"✓ User {user_upn} belongs to {len(groups)} groups")
+
+        with _group_cache_lock:
+            _group_cache[cache_key] = groups
         
     except Exception as e:
         print(f"⚠️ Error fetching groups for {user_upn}: {e}")
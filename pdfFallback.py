@@ -0,0 +1,55 @@
+from io import BytesIO, StringIO
+from typing import List, Union
+
+# Runs inside the PDF fallback process pool, so this module only imports pdfminer
+from pdfminer.converter import TextConverter
+from pdfminer.layout import LAParams
+from pdfminer.pdfinterp import PDFPageInterpreter, PDFResourceManager
+from pdfminer.pdfpage import PDFPage
+
+
+class TextOnlyInterpreter(PDFPageInterpreter):
+    """
+    pdfminer interpreter that skips path construction/painting and colour operators.
+    Presentation exports spend most of their content streams on these, and they
+    never produce text; BT/ET, Tf, Td, Tj, TJ etc. are still interpreted.
+    """
+    def do_m(self, x, y): pass
+    def do_l(self, x, y): pass
+    def do_c(self, x1, y1, x2, y2, x3, y3): pass
+    def do_v(self, x2, y2, x3, y3): pass
+    def do_y(self, x1, y1, x3, y3): pass
+    def do_h(self): pass
+    def do_re(self, x, y, w, h): pass
+    def do_S(self): pass
+    def do_s(self): pass
+    def do_f(self): pass
+    def do_F(self): pass
+    def do_f_a(self): pass
+    def do_B(self): pass
+    def do_B_a(self): pass
+    def do_b(self): pass
+    def do_b_a(self): pass
+    def do_n(self): pass
+    def do_G(self, gray): pass
+    def do_g(self, gray): pass
+    def do_RG(self, r, g, b): pass
+    def do_rg(self, r, g, b): pass
+    def do_K(self, c, m, y, k): pass
+    def do_k(self, c, m, y, k): pass
+    def do_sh(self, name): pass
+
+def extract_pdf_pages_worker(source: Union[str, bytes], page_numbers: List[int]) -> List[str]:
+    """pdfminer text for the given pages; runs inside the PDF process pool"""
+    rsrcmgr = PDFResourceManager()
+    texts = []
+
+    with (open(source, "rb") if isinstance(source, str) else BytesIO(source)) as fp:
+        for page in PDFPage.get_pages(fp, pagenos=set(page_numbers)):
+            output = StringIO()
+            device = TextConverter(rsrcmgr, output, laparams=LAParams())
+            TextOnlyInterpreter(rsrcmgr, device).process_page(page)
+            device.close()
+            texts.append(output.getvalue())
+
+    return texts